@@ -0,0 +1,23 @@
+"""Build script for the optional native transform kernel.
+
+    pip install pybind11
+    python setup.py build_ext --inplace
+
+Both Python entry points fall back to the OpenCV backend when the
+extension has not been built.
+"""
+from pybind11.setup_helpers import Pybind11Extension, build_ext
+from setuptools import setup
+
+setup(
+    name="cvd-recolor-native",
+    version="0.1.0",
+    ext_modules=[
+        Pybind11Extension(
+            "_recolor",
+            ["_recolor.cpp"],
+            extra_compile_args=["-O3"],
+        ),
+    ],
+    cmdclass={"build_ext": build_ext},
+)
@@ -45,9 +45,20 @@ export default function App() {
           }
         });
 
-        socketRef.current.on("processed_frame", (data: { frame: string }) => {
-          setProcessedVideoFrame(data.frame);
-        });
+        socketRef.current.on(
+          "processed_frame",
+          (data: { frame: ArrayBuffer; mime?: string }) => {
+            // The server sends raw JPEG bytes; wrap them in an object URL
+            // and revoke the previous frame's URL so we don't leak blobs.
+            const url = URL.createObjectURL(
+              new Blob([data.frame], { type: data.mime || "image/jpeg" })
+            );
+            setProcessedVideoFrame((prev) => {
+              if (prev) URL.revokeObjectURL(prev);
+              return url;
+            });
+          }
+        );
 
         socketRef.current.on("error", (data: { message: string }) => {
           console.error("WebSocket error:", data.message);
@@ -136,18 +147,22 @@ export default function App() {
         if (context) {
           try {
             context.drawImage(videoElement, 0, 0, canvas.width, canvas.height);
-            const frameData = canvas.toDataURL("image/jpeg", 0.8);
-            if (frameData && frameData.startsWith("data:image/jpeg;base64,")) {
-              socketRef.current.emit("video_frame", {
-                frame: frameData,
-                deficiency: deficiency,
-              });
-            } else {
-              console.error(
-                "Invalid frame data format:",
-                frameData ? frameData.substring(0, 30) : "null"
-              );
-            }
+            // Send the raw JPEG bytes as a binary payload; this avoids the
+            // 33% base64 overhead of a data URL on every frame.
+            canvas.toBlob(
+              (blob) => {
+                if (blob && socketRef.current && socketRef.current.connected) {
+                  blob.arrayBuffer().then((buffer) => {
+                    socketRef.current?.emit("video_frame", {
+                      frame: buffer,
+                      deficiency: deficiency,
+                    });
+                  });
+                }
+              },
+              "image/jpeg",
+              0.8
+            );
           } catch (err) {
             console.error("Error capturing video frame:", err);
           }
@@ -158,7 +173,10 @@ export default function App() {
 
   const stopVideoStreaming = () => {
     setIsVideoStreaming(false);
-    setProcessedVideoFrame(null);
+    setProcessedVideoFrame((prev) => {
+      if (prev) URL.revokeObjectURL(prev);
+      return null;
+    });
 
     if (streamIntervalRef.current) {
       window.clearInterval(streamIntervalRef.current);
@@ -634,7 +652,10 @@ export default function App() {
           onChange={(e) => {
             setDeficiency(e.target.value);
             if (isVideoMode && isVideoStreaming) {
-              setProcessedVideoFrame(null);
+              setProcessedVideoFrame((prev) => {
+                if (prev) URL.revokeObjectURL(prev);
+                return null;
+              });
             }
           }}
           style={{
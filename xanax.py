@@ -1,4 +1,16 @@
+try:
+    # Must run before anything else pulls in the blocking stdlib
+    # primitives it patches.
+    import eventlet
+    eventlet.monkey_patch()
+    ASYNC_MODE = 'eventlet'
+except ImportError:
+    # Dev fallback: the Werkzeug-based threading mode.
+    ASYNC_MODE = 'threading'
+
 import io
+import os
+import threading
 import cv2
 import numpy as np
 import base64
@@ -7,6 +19,24 @@ from flask import Flask, request, send_file, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+try:
+    import cupy as cp
+    HAVE_CUPY = cp.cuda.runtime.getDeviceCount() > 0
+except Exception:
+    HAVE_CUPY = False
+
+try:
+    import _recolor  # build with: python setup.py build_ext --inplace
+    HAVE_NATIVE = True
+except ImportError:
+    HAVE_NATIVE = False
+
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,8 +48,9 @@ CORS(app,
      methods=["GET", "POST", "OPTIONS"])
 
 # Configure SocketIO with CORS
-socketio = SocketIO(app, 
-                   cors_allowed_origins="*", 
+socketio = SocketIO(app,
+                   async_mode=ASYNC_MODE,
+                   cors_allowed_origins="*",
                    ping_timeout=60,
                    ping_interval=25,
                    logger=True,
@@ -63,39 +94,260 @@ DALT_MATS = {
     ]),
 }
 
-def transform_image(img: np.ndarray, mat: np.ndarray) -> np.ndarray:
+# recolor = simulate(daltonize(img)); both stages are linear, so the composed
+# matrix applies the whole pipeline in a single pass over the frame.
+RECOLOR_MATS = {d: SIM_MATS[d] @ DALT_MATS[d] for d in SIM_MATS}
+
+# The transform is linear in any fixed channel order, so the BGR<->RGB swap
+# can be absorbed into the matrix itself: M_bgr = P @ M @ P with P the
+# channel-reversal permutation.  Working directly on OpenCV's decoded BGR
+# frames saves two full-image cvtColor passes per frame.
+_P_BGR = np.array([
+    [0.0, 0.0, 1.0],
+    [0.0, 1.0, 0.0],
+    [1.0, 0.0, 0.0],
+])
+SIM_MATS_BGR = {d: _P_BGR @ m @ _P_BGR for d, m in SIM_MATS.items()}
+DALT_MATS_BGR = {d: _P_BGR @ m @ _P_BGR for d, m in DALT_MATS.items()}
+RECOLOR_MATS_BGR = {d: _P_BGR @ m @ _P_BGR for d, m in RECOLOR_MATS.items()}
+
+# Per-channel lookup tables: for a 3×3 matrix acting on uint8 input,
+# out = r*mat[:,0] + g*mat[:,1] + b*mat[:,2] and each channel only takes 256
+# values, so the per-channel contributions can be tabulated once.  A pixel
+# then costs three table lookups and two adds.
+def _channel_luts(mat: np.ndarray) -> tuple:
+    levels = np.arange(256, dtype=np.float32)
+    return tuple(np.outer(levels, mat[:, c]).astype(np.float32) for c in range(3))
+
+_LUT_CACHE = {}
+
+def _luts_for(mat: np.ndarray) -> tuple:
+    key = mat.tobytes()
+    if key not in _LUT_CACHE:
+        _LUT_CACHE[key] = _channel_luts(mat)
+    return _LUT_CACHE[key]
+
+def _transform_lut(img: np.ndarray, luts: tuple) -> np.ndarray:
+    lut_r, lut_g, lut_b = luts
+    acc = lut_r[img[..., 0]]
+    acc += lut_g[img[..., 1]]
+    acc += lut_b[img[..., 2]]
+    np.clip(acc, 0.0, 255.0, out=acc)
+    return acc.astype(np.uint8)
+
+# Q8 fixed point: quantize the matrix to 8 fractional bits so the per-pixel
+# multiply-add runs on integer SIMD lanes instead of float32.  The 1/256
+# coefficient resolution is well below the uint8 output quantum.
+def _quantize_q8(mat: np.ndarray) -> np.ndarray:
+    return np.round(mat * 256.0).astype(np.int16)
+
+_Q8_CACHE = {}
+
+def _q8_for(mat: np.ndarray) -> np.ndarray:
+    key = mat.tobytes()
+    if key not in _Q8_CACHE:
+        _Q8_CACHE[key] = _quantize_q8(mat)
+    return _Q8_CACHE[key]
+
+def transform_image_q(img: np.ndarray, mat_q: np.ndarray) -> np.ndarray:
+    # Accumulate in int32: |sum| can reach 256*255*3, past the int16 range.
+    t = np.tensordot(img.astype(np.int32), mat_q, axes=([2], [1]))
+    np.right_shift(t, 8, out=t)
+    np.clip(t, 0, 255, out=t)
+    return t.astype(np.uint8)
+
+_F32_CACHE = {}
+
+def _f32_for(mat: np.ndarray) -> np.ndarray:
+    key = mat.tobytes()
+    if key not in _F32_CACHE:
+        _F32_CACHE[key] = np.ascontiguousarray(mat, dtype=np.float32)
+    return _F32_CACHE[key]
+
+def transform_image_f32(img: np.ndarray, mat: np.ndarray) -> np.ndarray:
+    # Reference float32 path, kept for debugging the fast kernels
+    # (CVD_BACKEND=f32 routes everything through here).  einsum contracts the
+    # channel axis without materializing a transposed copy of the matrix;
+    # keeping it float32 avoids upcasting the whole frame to float64.
     f = img.astype(np.float32) / 255.0
-    t = np.dot(f, mat.T)
-    t = np.clip(t, 0.0, 1.0)
-    return (t * 255.0).astype(np.uint8)
-
-def color_recolor(img_rgb: np.ndarray,
-                  sim: np.ndarray,
-                    dalt: np.ndarray) -> np.ndarray:
-    img_dalton = transform_image(img_rgb, dalt)
-    img_rec = transform_image(img_dalton, sim)
-    return img_rec
-
-def process_frame(frame_data, deficiency):
-    """Process a video frame and return the recolored frame"""
+    t = np.einsum("hwc,kc->hwk", f, _f32_for(mat), optimize=True)
+    # convertScaleAbs fuses the *255 scale, rounding, and the upper
+    # saturation into one SIMD pass -- but it takes |src|, so negatives
+    # (the daltonization matrices produce them) must be floored to zero
+    # first to preserve the clip semantics.
+    np.maximum(t, 0.0, out=t)
+    return cv2.convertScaleAbs(t, alpha=255.0)
+
+# Populate the float32 cache for every known matrix at import, so not even
+# the first frame pays the cast.  einsum and cv2.transform both take the
+# matrix untransposed, so no transposed copies are kept.
+for _mat_dict in (SIM_MATS, DALT_MATS, RECOLOR_MATS,
+                  SIM_MATS_BGR, DALT_MATS_BGR, RECOLOR_MATS_BGR):
+    for _mat in _mat_dict.values():
+        _f32_for(_mat)
+
+# Kernel selection, mostly for benchmarking and debugging:
+#   opencv (default) - cv2.transform, SIMD-dispatched, saturates internally
+#   numba            - fused JIT kernel (falls back to q8 if numba is missing)
+#   lut              - per-channel lookup tables (3 lookups + 2 adds/pixel)
+#   q8               - int16 fixed-point tensordot
+#   f32              - reference float32 path
+#   cuda             - CuPy matmul on the GPU (needs a CUDA device)
+#   native           - pybind11 C++ kernel with runtime AVX2 dispatch
+_BACKEND = os.environ.get("CVD_BACKEND", "opencv")
+
+if HAVE_CUPY:
+    _GPU_CACHE = {}
+
+    def _gpu_for(mat: np.ndarray):
+        key = mat.tobytes()
+        if key not in _GPU_CACHE:
+            _GPU_CACHE[key] = cp.asarray(mat, dtype=cp.float32)
+        return _GPU_CACHE[key]
+
+    def transform_image_gpu(img: np.ndarray, mat: np.ndarray) -> np.ndarray:
+        # One H2D transfer, a (H*W,3)x(3,3) GEMM, clip, and one D2H
+        # transfer; the matrix lives on the device across calls.
+        f = cp.asarray(img, dtype=cp.float32).reshape(-1, 3)
+        t = f @ _gpu_for(mat).T
+        cp.clip(t, 0.0, 255.0, out=t)
+        return cp.asnumpy(t.astype(cp.uint8)).reshape(img.shape)
+
+if HAVE_NUMBA:
+    # One fused pass over the frame: the matrix stays in registers, LLVM
+    # vectorizes the 3-wide multiply-add, and no float temporary is ever
+    # materialized.
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _apply_mat_u8(img, mat, out):
+        H, W, _ = img.shape
+        for y in prange(H):
+            for x in range(W):
+                r = img[y, x, 0]
+                g = img[y, x, 1]
+                b = img[y, x, 2]
+                for k in range(3):
+                    v = mat[k, 0] * r + mat[k, 1] * g + mat[k, 2] * b
+                    out[y, x, k] = min(255, max(0, int(v)))
+
+    # Warm the JIT at import so the first socket frame doesn't pay
+    # compilation latency.  Only done when this backend is actually
+    # selected; compiling spins up numba's thread pool for nothing
+    # otherwise.
+    if _BACKEND == "numba":
+        _apply_mat_u8(
+            np.zeros((4, 4, 3), np.uint8),
+            np.eye(3, dtype=np.float32),
+            np.empty((4, 4, 3), np.uint8),
+        )
+
+def transform_image(img: np.ndarray, mat: np.ndarray,
+                    out: np.ndarray = None) -> np.ndarray:
+    # Default: cv2.transform runs OpenCV's SIMD-dispatched per-pixel matrix
+    # kernel on uint8 directly (dst = mat*src as column vectors, so the
+    # matrix is passed untransposed) and saturates to [0, 255] internally.
+    if _BACKEND == "f32":
+        return transform_image_f32(img, mat)
+    if _BACKEND == "cuda" and HAVE_CUPY:
+        return transform_image_gpu(img, mat)
+    if _BACKEND == "numba" and HAVE_NUMBA:
+        if out is None or out.shape != img.shape:
+            out = np.empty_like(img)
+        _apply_mat_u8(img, np.ascontiguousarray(mat, dtype=np.float32), out)
+        return out
+    if _BACKEND in ("q8", "numba"):
+        return transform_image_q(img, _q8_for(mat))
+    if _BACKEND == "lut":
+        return _transform_lut(img, _luts_for(mat))
+    if _BACKEND == "native" and HAVE_NATIVE:
+        if out is None or out.shape != img.shape:
+            out = np.empty_like(img)
+        _recolor.apply(img, _f32_for(mat), out)
+        return out
+    if out is not None and out.shape == img.shape:
+        return cv2.transform(img, _f32_for(mat), dst=out)
+    return cv2.transform(img, _f32_for(mat))
+
+def recolor_bgr(img_bgr: np.ndarray, deficiency: str,
+                out: np.ndarray = None) -> np.ndarray:
+    """Recolor a BGR frame in place of the old RGB round-trip; the channel
+    swap lives in the matrix, not in the image."""
+    return transform_image(img_bgr, RECOLOR_MATS_BGR[deficiency], out=out)
+
+# Per-session scratch buffers for the video path: webcam resolution is fixed
+# per client, so the output frame is allocated once on the first frame and
+# reused instead of being malloc'd 30 times a second.
+_SESSION_SCRATCH = {}
+
+def _scratch_for(sid, shape):
+    scratch = _SESSION_SCRATCH.get(sid)
+    if scratch is None or scratch['out'].shape != shape:
+        scratch = {'out': np.empty(shape, np.uint8)}
+        if sid is not None:
+            _SESSION_SCRATCH[sid] = scratch
+    return scratch
+
+# Latest-frame slots: when a client produces frames faster than the server
+# processes them, newer frames overwrite the pending one instead of queuing,
+# so latency stays bounded instead of growing without limit.  Each client
+# has at most one drain task in flight; the socket handler itself never
+# blocks on OpenCV work.
+_PENDING_FRAMES = {}
+_DRAINING_SIDS = set()
+_PENDING_LOCK = threading.Lock()
+
+def _drain_frames(sid):
+    while True:
+        with _PENDING_LOCK:
+            item = _PENDING_FRAMES.pop(sid, None)
+            if item is None:
+                _DRAINING_SIDS.discard(sid)
+                return
+        frame_data, deficiency = item
+        try:
+            processed = process_frame(frame_data, deficiency, sid)
+        except Exception as e:
+            logger.error(f'Error processing frame for {sid}: {str(e)}')
+            processed = None
+        if processed:
+            frame_bytes, scale = processed
+            # The scale lets the client map coordinates back to its capture
+            # resolution; the <img> itself upscales to fit its container.
+            socketio.emit('processed_frame',
+                          {'frame': frame_bytes, 'mime': 'image/jpeg',
+                           'scale': scale}, to=sid)
+        else:
+            socketio.emit('error', {'message': 'Failed to process frame'},
+                          to=sid)
+
+# Streamed frames are previews: pushing a full camera-resolution frame
+# through decode -> transform -> encode wastes work the browser throws away
+# when it fits the image to the page.  Frames larger than this on their long
+# side are downscaled before processing; 0 disables the cap.
+MAX_FRAME_DIM = int(os.environ.get('CVD_MAX_FRAME_DIM', '960'))
+
+def process_frame(frame_data, deficiency, sid=None):
+    """Process a video frame; returns (jpeg bytes, scale) or None."""
     try:
-        if not frame_data or not frame_data.startswith('data:image'):
-            logger.warning(f"Invalid frame data format: {frame_data[:30] if frame_data else 'None'}")
-            return None
-            
-        # Get the base64 part by splitting on comma
-        base64_data = frame_data.split(',', 1)
-        if len(base64_data) != 2:
-            logger.warning(f"Invalid base64 format, can't split: {frame_data[:30]}")
-            return None
-            
-        # Decode base64 image
         try:
-            img_data = base64.b64decode(base64_data[1])
+            # Preferred path: the client sends the raw JPEG bytes as a binary
+            # Socket.IO payload, so no base64 decode or string copy is needed.
+            if isinstance(frame_data, (bytes, bytearray, memoryview)):
+                img_data = frame_data
+            elif isinstance(frame_data, str) and frame_data.startswith('data:image'):
+                # Fallback for clients still sending base64 data URLs.
+                _, _, b64_data = frame_data.partition(',')
+                if not b64_data:
+                    logger.warning(f"Invalid base64 format, can't split: {frame_data[:30]}")
+                    return None
+                img_data = base64.b64decode(b64_data)
+            else:
+                logger.warning(f"Invalid frame data format: {str(frame_data)[:30] if frame_data else 'None'}")
+                return None
+
             if not img_data:
-                logger.warning("Decoded base64 data is empty")
+                logger.warning("Frame data is empty")
                 return None
-                
+
             # Convert to numpy array
             data = np.frombuffer(img_data, dtype=np.uint8)
             if data.size == 0:
@@ -107,17 +359,22 @@ def process_frame(frame_data, deficiency):
                 logger.warning("OpenCV could not decode the image data")
                 return None
                 
-            img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-            sim_mat = SIM_MATS[deficiency]
-            dalt_mat = DALT_MATS[deficiency]
-            out_rgb = color_recolor(img_rgb, sim_mat, dalt_mat)
-            
-            out_bgr = cv2.cvtColor(out_rgb, cv2.COLOR_RGB2BGR)
+            h, w = img_bgr.shape[:2]
+            scale = 1.0
+            if MAX_FRAME_DIM > 0 and max(h, w) > MAX_FRAME_DIM:
+                scale = MAX_FRAME_DIM / float(max(h, w))
+                img_bgr = cv2.resize(img_bgr, None, fx=scale, fy=scale,
+                                     interpolation=cv2.INTER_AREA)
+
+            scratch = _scratch_for(sid, img_bgr.shape)
+            out_bgr = recolor_bgr(img_bgr, deficiency, out=scratch['out'])
 
             _, buffer = cv2.imencode('.jpg', out_bgr, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
 
-            encoded_frame = base64.b64encode(buffer).decode('utf-8')
-            return f"data:image/jpeg;base64,{encoded_frame}"
+            # Return raw JPEG bytes; Socket.IO carries binary payloads
+            # natively, so base64-encoding the response would only add 33%
+            # bandwidth and an extra pass over the buffer.
+            return bytes(buffer), scale
         except base64.binascii.Error as e:
             logger.error(f"Base64 decoding error: {str(e)}")
             return None
@@ -153,12 +410,7 @@ def correct_image(deficiency):
         if img_bgr is None:
             return jsonify({"error": "Cannot decode image"}), 400
 
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        sim_mat = SIM_MATS[deficiency]
-        dalt_mat = DALT_MATS[deficiency]
-        out_rgb = color_recolor(img_rgb, sim_mat, dalt_mat)
-
-        out_bgr = cv2.cvtColor(out_rgb, cv2.COLOR_RGB2BGR)
+        out_bgr = recolor_bgr(img_bgr, deficiency)
         _, buf = cv2.imencode('.png', out_bgr)
 
         return send_file(
@@ -177,6 +429,9 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    _SESSION_SCRATCH.pop(request.sid, None)
+    with _PENDING_LOCK:
+        _PENDING_FRAMES.pop(request.sid, None)
     logger.info(f'Client disconnected: {request.sid}')
 
 @socketio.on('video_frame')
@@ -195,15 +450,26 @@ def handle_video_frame(data):
             emit('error', {'message': f'Invalid deficiency type. Choose from {list(SIM_MATS.keys())}'})
             return
         
-        processed_frame = process_frame(frame_data, deficiency)
-        if processed_frame:
-            emit('processed_frame', {'frame': processed_frame})
-        else:
-            emit('error', {'message': 'Failed to process frame'})
+        sid = request.sid
+        with _PENDING_LOCK:
+            _PENDING_FRAMES[sid] = (frame_data, deficiency)
+            start_drain = sid not in _DRAINING_SIDS
+            if start_drain:
+                _DRAINING_SIDS.add(sid)
+        if start_drain:
+            socketio.start_background_task(_drain_frames, sid)
     except Exception as e:
         logger.error(f'Error in video_frame handler: {str(e)}')
         emit('error', {'message': f'Server error: {str(e)}'})
 
 if __name__ == '__main__':
-    logger.info("Starting CVD Recolorization server")
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
+    # With eventlet installed this serves through eventlet's WSGI server;
+    # for a managed deployment use
+    #   gunicorn -k eventlet -w 1 --bind 0.0.0.0:5000 xanax:app
+    # (one worker: Socket.IO sessions are sticky to a process).  The
+    # Werkzeug path only remains as a dev fallback when eventlet is
+    # missing, gated behind FLASK_DEBUG=1.
+    logger.info(f"Starting CVD Recolorization server (async_mode={socketio.async_mode})")
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    socketio.run(app, host='0.0.0.0', port=5000, debug=debug,
+                 allow_unsafe_werkzeug=(ASYNC_MODE == 'threading'))